@@ -1,47 +1,84 @@
 import csv
 import os
 import re
-from collections.abc import Iterator, Mapping, Sequence
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
 from logging import getLogger
-from typing import Protocol
+from operator import itemgetter, methodcaller
+from typing import Any, Protocol, TYPE_CHECKING
 
-from .cluster import clusterize_sentences
+from joblib import Parallel, delayed
+
+from .cache import EmbeddingCache
+from .cluster import Cluster, cluster_embeddings, embed_sentences
 from .configs import AnalyzerConfig
-from .functions import iterate_questions
-from .globals import PreprocessFunc
+from .functions import compile_pattern, iterate_questions, prefetch
+from .globals import PreprocessFunc, QuestionLists
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+    from sentence_transformers import SentenceTransformer
 
 logger = getLogger('analyzer')
 
+CSV_BUFFER_SIZE = 1 << 20
+
 
 def make_preprocessing_function(
         punctuation: str,
         text_to_replace: Mapping[str, str],
         text_to_remove: Sequence[str],
         /,
+        use_re2: bool = False,
         ) -> PreprocessFunc:
     """
     Creates a preprocessing function from the given config.
+    Regular expressions are compiled with RE2 engine if ``use_re2`` is true.
+
+    All strings from ``text_to_replace`` are replaced in a single pass.
+    If several of them start at the same position, the longest one is replaced.
     """
-    pattern_text_to_remove = re.compile('|'.join(text_to_remove), re.I)
-    pattern_spaces = re.compile(r'\s+')
-    pattern_space_punctuation = re.compile(rf' ([{punctuation}])')
+    # Longer strings go first, so they take precedence over their prefixes.
+    # The pattern never matches if there is nothing to replace.
+    keys_to_replace = sorted(text_to_replace, key=len, reverse=True)
+    pattern_text_to_replace = compile_pattern(
+        '|'.join(map(re.escape, keys_to_replace)) or r'[^\s\S]',
+        use_re2=use_re2,
+        )
+    pattern_text_to_remove = compile_pattern(
+        '|'.join(text_to_remove),
+        ignorecase=True,
+        use_re2=use_re2,
+        )
+    pattern_spaces = compile_pattern(rf'\s+([{punctuation}])?', use_re2=use_re2)
     space_punctuation = ' ' + punctuation
 
-    def preprocess(data: Sequence[str], /) -> Iterator[str]:
-        for s in data:
-            # Replace text
-            for old, new in text_to_replace.items():
-                s = s.replace(old, new)
-
-            # Remove text
-            s = pattern_text_to_remove.sub(' ', s)
-            # Remove punctuation on edges
-            s = s.strip(space_punctuation)
-            # Purge consecutive spaces
-            s = pattern_spaces.sub(' ', s)
-            # Remove spaces before punctuation
-            s = pattern_space_punctuation.sub(r'\1', s)
-            yield s
+    def replace_text(m: re.Match, /) -> str:
+        return text_to_replace[m.group(0)]
+
+    def replace_spaces(m: re.Match, /) -> str:
+        # Spaces before punctuation are removed, other spaces are purged into one
+        return m.group(1) or ' '
+
+    # Every step is a callable implemented in C,
+    # so no Python frame is created per sentence, only per match of callbacks above.
+    replace = partial(pattern_text_to_replace.sub, replace_text)
+    remove = partial(pattern_text_to_remove.sub, ' ')
+    strip = methodcaller('strip', space_punctuation)
+    purge_spaces = partial(pattern_spaces.sub, replace_spaces)
+
+    def preprocess(data: Iterable[str], /) -> Iterator[str]:
+        # Replace text
+        it = map(replace, data)
+        # Remove text
+        it = map(remove, it)
+        # Remove punctuation on edges
+        it = map(strip, it)
+        # Purge consecutive spaces and remove spaces before punctuation
+        return map(purge_spaces, it)
 
     return preprocess
 
@@ -71,6 +108,13 @@ def make_row_maker(
     """
     Creates a :class:`RowMaker` with the given settings.
     """
+    # Columns are chosen once here, so making a row involves no checks
+    included = include_category, include_subcategory, include_topic
+    indices = [i for i, include in enumerate(included) if include]
+    # Level, question and flag are always included
+    indices.extend((3, 4, 5))
+    select_columns = itemgetter(*indices)
+
     def make_row(
             category: str,
             subcategory: str,
@@ -80,34 +124,128 @@ def make_row_maker(
             flag: bool,
             /,
             ) -> list:
-        row = []
-        if include_category: row.append(category)
-        if include_subcategory: row.append(subcategory)
-        if include_topic: row.append(topic)
+        return list(select_columns((category, subcategory, topic, level, question, flag)))
 
-        row.append(level)
-        row.append(question)
-        row.append(flag)
+    return make_row
 
-        return row
 
-    return make_row
+def export_quantized_onnx_model(model_name: str, quantization: str, dirpath: str, /) -> str:
+    """
+    Exports the given model to ONNX with int8 dynamic quantization
+    for the given quantization configuration into the given directory.
+    The export is skipped if the directory already contains the quantized model.
 
+    Returns the path to the quantized model file relative to the directory.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
 
-def analyze(config: AnalyzerConfig, /) -> None:
+    filename = f'onnx/model_qint8_{quantization}.onnx'
+    if not os.path.isfile(os.path.join(dirpath, filename)):
+        logger.info(
+            f'Exporting model {model_name!r} '
+            f'with {quantization} quantization to {dirpath!r}'
+            )
+        model = SentenceTransformer(model_name, backend='onnx')
+        model.save(dirpath)
+        export_dynamic_quantized_onnx_model(model, quantization, dirpath)
+
+    return filename
+
+
+def get_device(config: AnalyzerConfig, /) -> str:
     """
-    Runs analysis using the given configuration.
+    Returns the device from the given config.
+    If the device is not specified, returns GPU if it is available and CPU otherwise.
+    """
+    import torch
+
+    return config.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def get_torch_dtype(config: AnalyzerConfig, device: str, /) -> str:
+    """
+    Returns the data type from the given config which is actually used on the given device.
+    """
+    if device.startswith('cpu') and config.torch_dtype == 'float16':
+        # Most CPUs lack native float16 arithmetic, bfloat16 is the closest alternative.
+        return 'bfloat16'
+
+    return config.torch_dtype
+
+
+def load_sentence_transformer(config: AnalyzerConfig, /) -> 'SentenceTransformer':
+    """
+    Loads :class:`SentenceTransformer` with the model, backend and data type from the given config.
+    If the device is not specified in the config,
+    the model is placed on GPU if it is available and on CPU otherwise.
     """
     from sentence_transformers import SentenceTransformer
 
+    device = get_device(config)
+    model_name = config.sentence_transformer_model
+    backend = config.backend
+    model_kwargs = {}
+    if backend == 'torch':
+        torch_dtype = get_torch_dtype(config, device)
+        if torch_dtype != config.torch_dtype:
+            logger.warning('Data type float16 is not supported on CPU, using bfloat16 instead')
+
+        model_kwargs['torch_dtype'] = torch_dtype
+        logger.info(f'Loading model {model_name!r} on {device} with data type {torch_dtype}')
+
+    else:
+        if backend == 'onnx' and config.quantization:
+            model_kwargs['file_name'] = export_quantized_onnx_model(
+                model_name,
+                config.quantization,
+                config.onnx_model_dirpath,
+                )
+            model_name = config.onnx_model_dirpath
+
+        logger.info(f'Loading model {model_name!r} on {device} with {backend} backend')
+
+    return SentenceTransformer(
+        model_name,
+        device=device,
+        backend=backend,
+        model_kwargs=model_kwargs,
+        )
+
+
+def cluster_topic(
+        q_lists: Sequence[list[str]],
+        embeddings: 'ndarray',
+        hdbscan_params: dict[str, Any],
+        /,
+        ) -> list[list[Cluster]]:
+    """
+    Clusters questions of every level of a topic separately.
+    Embeddings of all levels must go one after another in the same order as the levels.
+    """
+    result = []
+    start = 0
+    for q_list in q_lists:
+        stop = start + len(q_list)
+        result.append(cluster_embeddings(q_list, embeddings[start:stop], hdbscan_params))
+        start = stop
+
+    return result
+
+
+def analyze(config: AnalyzerConfig, /) -> None:
+    """
+    Runs analysis using the given configuration.
+    """
     logger.info('Starting the analyzer...')
 
-    model = SentenceTransformer(config.sentence_transformer_model)
+    model = load_sentence_transformer(config)
+    batch_size = config.batch_size
     hdbscan_params = config.hdbscan_params.copy()
     preprocess = make_preprocessing_function(
         config.punctuation,
         config.text_to_replace.copy(),
         config.text_to_remove,
+        use_re2=config.use_re2,
         )
 
     include_duplicates = config.include_duplicates
@@ -124,46 +262,79 @@ def analyze(config: AnalyzerConfig, /) -> None:
         config.topics,
         )
 
+    def embed_topic(item: tuple[str, str, str, QuestionLists], /) -> 'ndarray':
+        # Encode questions of all levels at once and split embeddings per level later
+        all_prep = list(preprocess(chain.from_iterable(item[3].values())))
+        return embed_sentences(all_prep, model, batch_size=batch_size, cache=cache)
+
+    # The model is not thread-safe, hence only one worker
+    executor = ThreadPoolExecutor(1, thread_name_prefix='encoder')
+    cache = None
     csvfile = None
     count_total = 0
     count_unique = 0
     count_written = 0
     try:
+        if config.embedding_cache_filepath:
+            cache_dir = os.path.dirname(config.embedding_cache_filepath)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+
+            # Embeddings depend not only on the model, but also on how it is run
+            namespace = '|'.join((
+                config.sentence_transformer_model,
+                config.backend,
+                get_torch_dtype(config, get_device(config)),
+                config.quantization,
+                ))
+            cache = EmbeddingCache(config.embedding_cache_filepath, namespace)
+
         csvfile_dir = os.path.dirname(config.output_filepath)
         if csvfile_dir:
             os.makedirs(csvfile_dir, exist_ok=True)
 
-        csvfile = open(config.output_filepath, 'w', newline='')
+        csvfile = open(config.output_filepath, 'w', newline='', buffering=CSV_BUFFER_SIZE)
         writer = csv.writer(csvfile, dialect='excel')
 
         logger.info('The analyzer is started')
-        for category, subcategory, topic, q_lists in iterator:
-            logger.info(f'Analyzing questions from topic {topic!r}')
-            for level, q_list in enumerate(q_lists.values(), 2):
-                clusters = clusterize_sentences(
-                    q_list,
-                    preprocess,
-                    model,
-                    hdbscan_params,
-                    )
+        # Next topics are encoded in the background while the current one is clustered
+        it = prefetch(embed_topic, iterator, executor, 2)
+        # Parallel consumes tasks ahead of results, hence topic names are queued separately
+        pending_topics: deque[tuple[str, str, str]] = deque()
+
+        def iterate_tasks() -> Iterator[Any]:
+            for item, embeddings in it:
+                pending_topics.append(item[:3])
+                yield delayed(cluster_topic)(list(item[3].values()), embeddings, hdbscan_params)
 
+        parallel = Parallel(n_jobs=config.n_jobs, return_as='generator')
+        for level_clusters in parallel(iterate_tasks()):
+            category, subcategory, topic = pending_topics.popleft()
+            logger.info(f'Analyzing questions from topic {topic!r}')
+            # Rows of the whole topic are written at once
+            rows = []
+            for level, clusters in enumerate(level_clusters, 2):
                 for cluster in clusters:
                     count_total += len(cluster)
                     count_unique += 1
+                    core_string = cluster.core_string
                     if include_duplicates:
                         for question in cluster:
-                            flag = question is not cluster.core_string
+                            flag = question is not core_string
                             row = make_row(category, subcategory, topic, level, question, flag)
-                            writer.writerow(row)
-                            count_written += 1
+                            rows.append(row)
 
                     else:
-                        question = cluster.core_string
-                        row = make_row(category, subcategory, topic, level, question, False)
-                        writer.writerow(row)
-                        count_written += 1
+                        row = make_row(category, subcategory, topic, level, core_string, False)
+                        rows.append(row)
+
+            writer.writerows(rows)
+            count_written += len(rows)
 
     finally:
+        executor.shutdown(cancel_futures=True)
+        if cache: cache.close()
+
         if csvfile:
             logger.info(f'Saving result to {config.output_filepath!r}')
             csvfile.close()
@@ -177,4 +348,12 @@ def analyze(config: AnalyzerConfig, /) -> None:
             )
 
 
-__all__ = 'analyze', 'make_preprocessing_function', 'make_row_maker'
+__all__ = (
+    'analyze',
+    'export_quantized_onnx_model',
+    'get_device',
+    'get_torch_dtype',
+    'load_sentence_transformer',
+    'make_preprocessing_function',
+    'make_row_maker',
+    )
@@ -0,0 +1,82 @@
+import sqlite3
+from collections.abc import Sequence
+from hashlib import blake2b
+from typing import Self
+
+from numpy import float32, frombuffer, ndarray
+
+SELECT_CHUNK_SIZE = 999
+
+
+class EmbeddingCache:
+    """
+    A persistent cache of sentence embeddings stored in SQLite database.
+
+    Embeddings are keyed by a hash of the sentence and the namespace.
+    The namespace must identify the model and its settings,
+    so embeddings produced by different models never mix.
+    """
+    __slots__ = '_connection', '_namespace'
+
+    def __init__(self, filepath: str, namespace: str, /) -> None:
+        # The cache can be filled from a thread other than the one which opened it
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings '
+            '(key BLOB PRIMARY KEY, embedding BLOB NOT NULL) WITHOUT ROWID'
+            )
+        self._namespace = namespace.encode() + b'\0'
+
+    def _make_key(self, sentence: str, /) -> bytes:
+        return blake2b(self._namespace + sentence.encode(), digest_size=16).digest()
+
+    def get_many(self, sentences: Sequence[str], /) -> list[ndarray | None]:
+        """
+        Returns the list of cached embeddings for the given sentences.
+        If an embedding of a sentence is not cached, the corresponding element is ``None``.
+        """
+        keys = [self._make_key(sentence) for sentence in sentences]
+        found = {}
+        # Keys are looked up in chunks, since SQLite limits the number of query parameters
+        for start in range(0, len(keys), SELECT_CHUNK_SIZE):
+            chunk = keys[start:start + SELECT_CHUNK_SIZE]
+            found.update(self._connection.execute(
+                'SELECT key, embedding FROM embeddings '
+                f'WHERE key IN ({', '.join('?' * len(chunk))})',
+                chunk,
+                ))
+
+        result = []
+        for key in keys:
+            embedding = found.get(key)
+            result.append(None if embedding is None else frombuffer(embedding, dtype=float32))
+
+        return result
+
+    def put_many(self, sentences: Sequence[str], embeddings: Sequence[ndarray], /) -> None:
+        """
+        Stores the given embeddings of the given sentences in the cache.
+        """
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO embeddings VALUES (?, ?)',
+                (
+                    (self._make_key(sentence), embedding.astype(float32, copy=False).tobytes())
+                    for sentence, embedding in zip(sentences, embeddings, strict=True)
+                    ),
+                )
+
+    def close(self, /) -> None:
+        """
+        Closes the underlying database.
+        """
+        self._connection.close()
+
+    def __enter__(self, /) -> Self:
+        return self
+
+    def __exit__(self, /, *_) -> None:
+        self.close()
+
+
+__all__ = 'EmbeddingCache',
@@ -2,10 +2,13 @@ import sys
 from collections.abc import Iterator, Sequence
 from typing import Any, NamedTuple, Self, overload
 
-from numpy import array_equal, ndarray
+from numpy import array, clip, fill_diagonal, flatnonzero, float32, float64, ix_, ndarray, stack
 from sentence_transformers import SentenceTransformer
 from sklearn.cluster import HDBSCAN
+from sklearn.metrics import pairwise_distances
+from sklearn.preprocessing import normalize
 
+from .cache import EmbeddingCache
 from .globals import PreprocessFunc
 
 
@@ -27,8 +30,11 @@ _ATTR_PROBABILITY = Sample.probability.__get__
 class Cluster:
     """
     A class repressing a cluster of strings.
+
+    The core string always goes first, other strings follow in sorted order.
+    Consumers can rely on this order and do not need to sort clusters themselves.
     """
-    __slots__ = '_strings', '_embeddings', '_probabilities'
+    __slots__ = '_strings', '_embeddings', '_probabilities', '_string_indices'
 
     _core_idx = 0
 
@@ -36,7 +42,9 @@ class Cluster:
         # Use sorted to sort and copy the sequence.
         samples = sorted(samples, key=_ATTR_SENTENCE)
         for i, sample in enumerate(samples):
-            if sample == core_sample:
+            # The core sample is usually one of the given samples,
+            # check identity first to avoid comparing embeddings.
+            if sample is core_sample or sample == core_sample:
                 if i != self._core_idx:
                     del samples[i]
                     samples.insert(self._core_idx, sample)
@@ -46,8 +54,12 @@ class Cluster:
             raise ValueError(f'core sample {core_sample!r} is not in the given samples')
 
         self._strings: tuple[str, ...] = tuple(map(_ATTR_SENTENCE, samples))
-        self._embeddings: tuple[ndarray[float], ...] = tuple(map(_ATTR_EMBEDDING, samples))
-        self._probabilities: tuple[float, ...] = tuple(map(_ATTR_PROBABILITY, samples))
+        # Embeddings and probabilities are stored contiguously, one row per string
+        self._embeddings: ndarray = stack(list(map(_ATTR_EMBEDDING, samples)))
+        self._embeddings.flags.writeable = False
+        self._probabilities: ndarray = array(list(map(_ATTR_PROBABILITY, samples)), dtype=float64)
+        self._probabilities.flags.writeable = False
+        self._string_indices: dict[str, int] | None = None
 
     @classmethod
     def from_single(cls, sentence: str, embedding: ndarray[float], /) -> Self:
@@ -72,16 +84,17 @@ class Cluster:
         return self._strings
 
     @property
-    def embeddings(self, /) -> Sequence[ndarray[float]]:
+    def embeddings(self, /) -> ndarray:
         """
-        Embeddings of the strings forming this cluster.
+        Read-only 2-dimensional array of embeddings of the strings forming this cluster.
+        Every row is an embedding of the string at the same index.
         """
         return self._embeddings
 
     @property
-    def probabilities(self, /) -> Sequence[float]:
+    def probabilities(self, /) -> ndarray:
         """
-        Probabilities of the strings forming this cluster.
+        Read-only array of probabilities of the strings forming this cluster.
         """
         return self._probabilities
 
@@ -125,8 +138,23 @@ class Cluster:
     def __iter__(self, /) -> Iterator[str]:
         return iter(self._strings)
 
+    def _get_string_indices(self, /) -> dict[str, int]:
+        # Built on the first lookup, maps every string to the index of its first occurrence
+        if self._string_indices is None:
+            string_indices = {}
+            for idx, s in enumerate(self._strings):
+                string_indices.setdefault(s, idx)
+
+            self._string_indices = string_indices
+
+        return self._string_indices
+
     def __contains__(self, item: Any, /) -> bool:
-        return item in self._strings
+        try:
+            return item in self._get_string_indices()
+        except TypeError:
+            # Unhashable objects are never equal to strings
+            return False
 
     def __len__(self, /) -> int:
         return len(self._strings)
@@ -152,7 +180,20 @@ class Cluster:
         The returned index is computed relative to the beginning of the full cluster
         rather than the ``start`` argument.
         """
+        try:
+            first_idx = self._get_string_indices().get(value)
+        except TypeError:
+            # Unhashable objects are never equal to strings
+            first_idx = None
+
+        if first_idx is None:
+            raise ValueError(f'{value!r} is not in the cluster')
+
         indices = range(*slice(start, stop).indices(len(self._strings)))
+        if first_idx in indices:
+            return first_idx
+
+        # The value can occur again after the first occurrence
         for idx in indices:
             sample = self._strings[idx]
             if value is sample or value == sample:
@@ -164,6 +205,10 @@ class Cluster:
         """
         Returns the number of occurrences inside this cluster of the given value.
         """
+        if len(self._get_string_indices()) == len(self._strings):
+            # All strings are unique
+            return int(value in self)
+
         return sum(1 for v in self._strings if v is value or v == value)
 
     def __hash__(self, /) -> int:
@@ -182,47 +227,113 @@ class Cluster:
         return NotImplemented
 
 
-def clusterize_sentences(
-        data: Sequence[str],
-        preprocess_func: PreprocessFunc,
+def embed_sentences(
+        sentences: Sequence[str],
         model: SentenceTransformer,
+        /,
+        batch_size: int = 64,
+        cache: EmbeddingCache | None = None,
+        ) -> ndarray:
+    """
+    Evaluates embeddings of the given sentences using the given model.
+    All sentences are encoded in a single call to the model.
+
+    :class:`SentenceTransformer` sorts sentences by length before splitting them
+    into mini-batches of the given size, hence every mini-batch is padded
+    only to the longest sentence inside it rather than to the longest sentence overall.
+
+    If the cache is specified, only sentences missing in it are encoded,
+    and their embeddings are added to the cache.
+
+    Returns 2-dimensional array where every row is an embedding of the corresponding sentence.
+    """
+    if cache is None or not sentences:
+        return model.encode(
+            list(sentences),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            )
+
+    embeddings = cache.get_many(sentences)
+    missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing_indices:
+        missing_sentences = [sentences[i] for i in missing_indices]
+        missing_embeddings = embed_sentences(missing_sentences, model, batch_size=batch_size)
+        cache.put_many(missing_sentences, missing_embeddings)
+        for i, embedding in zip(missing_indices, missing_embeddings):
+            embeddings[i] = embedding
+
+    return stack(embeddings)
+
+
+def compute_distances(
+        embeddings: ndarray,
+        metric: str,
+        metric_params: dict[str, Any],
+        /,
+        ) -> ndarray:
+    """
+    Computes the matrix of pairwise distances between the given embeddings
+    using the given metric and its parameters.
+
+    Cosine distances are computed with a single multiplication of normalized embeddings.
+    """
+    if metric == 'cosine':
+        # NumPy has no fast matrix product for float16
+        normalized = normalize(embeddings.astype(float32, copy=False))
+        distances = 1 - normalized @ normalized.T
+        # Remove rounding errors
+        clip(distances, 0, 2, out=distances)
+        fill_diagonal(distances, 0)
+        return distances
+
+    return pairwise_distances(embeddings, metric=metric, **metric_params)
+
+
+def cluster_embeddings(
+        data: Sequence[str],
+        embeddings: ndarray,
         hdbscan_params: dict[str, Any],
         /,
         ) -> list[Cluster]:
     """
-    Preprocesses the given data with the given preprocessing function,
-    then evaluates embeddings using :class:`SentenceTransformer` with the given model
-    and then applies HDBSCAN with the given parameters to get clusters.
+    Applies HDBSCAN with the given parameters to the given embeddings to get clusters.
+    Every row of the embeddings must correspond to the sentence at the same index in the data.
+    Pairwise distances are computed once beforehand and passed to HDBSCAN as a precomputed matrix.
 
     Returns the list of resulting clusters.
     """
-    prep_data = list(preprocess_func(data))
-    embeddings = model.encode(prep_data, convert_to_numpy=True)
-
-    hdbscan_params['store_centers'] = 'medoid'
-    est = HDBSCAN(**hdbscan_params)
-    est.fit(embeddings)
-
-    label_range = range(max(est.labels_) + 1)
-    groups: list[list[Sample]] = [[] for _ in label_range]
-    medoids: list[Sample] = [... for _ in label_range]
-    clusters = []
-
-    it: Iterator[tuple[int, str, ndarray[float], float]]
-    it = zip(est.labels_, data, embeddings, est.probabilities_, strict=True)
-    for label, sentence, embedding, probability in it:
-        if label <= -1:
-            clusters.append(Cluster.from_single(sentence, embedding))
-        else:
-            sample = Sample(sentence, embedding, probability)
-            groups[label].append(sample)
-            if array_equal(embedding, est.medoids_[label]):
-                medoids[label] = sample
-
-    clusters.extend(
-        Cluster(group, medoid)
-        for group, medoid in zip(groups, medoids, strict=True)
+    hdbscan_params = hdbscan_params.copy()
+    # HDBSCAN cannot store centers for precomputed distances, medoids are computed below
+    hdbscan_params.pop('store_centers', None)
+    # Without a copy HDBSCAN may overwrite distances with mutual reachability,
+    # but the original distances are needed for medoids
+    hdbscan_params['copy'] = True
+    distances = compute_distances(
+        embeddings,
+        hdbscan_params.pop('metric', 'euclidean'),
+        hdbscan_params.pop('metric_params', None) or {},
         )
+    est = HDBSCAN(metric='precomputed', **hdbscan_params)
+    est.fit(distances)
+
+    labels = est.labels_
+    probabilities = est.probabilities_
+    # Noise samples form clusters of their own
+    clusters = [Cluster.from_single(data[i], embeddings[i]) for i in flatnonzero(labels <= -1)]
+    for label in range(labels.max() + 1):
+        indices = flatnonzero(labels == label)
+        samples = [Sample(data[i], embeddings[i], probabilities[i]) for i in indices]
+        # Like in HDBSCAN, a medoid minimizes the sum of distances
+        # to other members of its cluster weighted by their probabilities.
+        weighted_distances = distances[ix_(indices, indices)] * probabilities[indices]
+        best = weighted_distances.sum(axis=1).argmin()
+        # Several samples can share the embedding of the medoid, e.g., equal sentences.
+        # The last of them is chosen, as it was when medoids were taken from HDBSCAN.
+        equal = flatnonzero((embeddings[indices] == embeddings[indices[best]]).all(axis=1))
+        medoid = samples[equal[-1]]
+        clusters.append(Cluster(samples, medoid))
 
     # Sort clusters to preserve their order
     # if different settings yield the same result.
@@ -230,4 +341,28 @@ def clusterize_sentences(
     return clusters
 
 
-__all__ = 'Cluster', 'clusterize_sentences',
+def clusterize_sentences(
+        data: Sequence[str],
+        preprocess_func: PreprocessFunc,
+        model: SentenceTransformer,
+        hdbscan_params: dict[str, Any],
+        /,
+        ) -> list[Cluster]:
+    """
+    Preprocesses the given data with the given preprocessing function,
+    then evaluates embeddings using :class:`SentenceTransformer` with the given model
+    and then applies HDBSCAN with the given parameters to get clusters.
+
+    Returns the list of resulting clusters.
+    """
+    embeddings = embed_sentences(list(preprocess_func(data)), model)
+    return cluster_embeddings(data, embeddings, hdbscan_params)
+
+
+__all__ = (
+    'Cluster',
+    'embed_sentences',
+    'compute_distances',
+    'cluster_embeddings',
+    'clusterize_sentences',
+    )
@@ -1,9 +1,40 @@
 from collections.abc import Iterator, Sequence
+from functools import cache
+from itertools import chain
+from typing import TYPE_CHECKING
 
-from sentence_transformers import SentenceTransformer
+from numpy import float32, ndarray, tril
+from numpy.linalg import norm
 
+from .cache import EmbeddingCache
 from .globals import PreprocessFunc
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+@cache
+def load_model(model_name: str, /) -> 'SentenceTransformer':
+    """
+    Loads :class:`SentenceTransformer` with the given model.
+    The model is placed on GPU if it is available and on CPU otherwise.
+
+    The model is loaded once and reused by subsequent calls.
+    PyTorch and Sentence Transformers are imported only on the first call.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # Half precision is enough to compare similarities with a threshold,
+    # but it is fast only on GPU
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    torch_dtype = 'float16' if device == 'cuda' else 'float32'
+    return SentenceTransformer(
+        model_name,
+        device=device,
+        model_kwargs={'torch_dtype': torch_dtype},
+        )
+
 
 def analyze_sentences(
         data: Sequence[str],
@@ -24,28 +55,92 @@ def analyze_sentences(
     if their similarity score is greater than or equal to the given threshold.
     If the threshold is not in open range (0, 1), then no analysis is made.
     """
-    length = len(data)
-    flags = [False] * length
+    return analyze_sentence_groups([data], preprocess_func, model_name, threshold)[0]
+
+
+def analyze_sentence_groups(
+        groups: Sequence[Sequence[str]],
+        preprocess_func: PreprocessFunc,
+        model_name: str,
+        threshold: float,
+        /,
+        batch_size: int = 256,
+        cache: EmbeddingCache | None = None,
+        ) -> list[Iterator[tuple[str, bool]]]:
+    """
+    Does the same as :func:`analyze_sentences` for every group of the given groups
+    and returns a list of results for every group.
+
+    Sentences of all groups are encoded at once,
+    but every sentence is compared only with sentences of its own group.
+    If the cache is specified, only sentences missing in it are encoded.
+    """
+    if not 0 < threshold < 1:
+        return [zip(group, [False] * len(group)) for group in groups]
+
+    sentences = list(preprocess_func(chain.from_iterable(groups)))
+    # Equal sentences are encoded only once
+    sentence_indices = {}
+    for sentence in sentences:
+        sentence_indices.setdefault(sentence, len(sentence_indices))
+
+    # The model returns a 1-dimensional array for no sentences
+    if not sentence_indices:
+        return [zip(group, ()) for group in groups]
+
+    from .cluster import embed_sentences
+
+    model = load_model(model_name)
+    embeddings = embed_sentences(list(sentence_indices), model, batch_size=batch_size, cache=cache)
+    # NumPy has no fast matrix product for float16
+    embeddings = embeddings.astype(float32, copy=False)
+    # Normalized embeddings make their dot product equal to cosine similarity.
+    # They are normalized after caching, so the cache can be shared with the analyzer.
+    embeddings /= norm(embeddings, axis=1, keepdims=True)
+
+    result = []
+    start = 0
+    for group in groups:
+        stop = start + len(group)
+        # Repeated sentences are always similar to their first occurrences,
+        # hence only first occurrences are compared
+        first_positions = {}
+        for position, sentence in enumerate(sentences[start:stop]):
+            first_positions.setdefault(sentence_indices[sentence], position)
+
+        flags = [True] * len(group)
+        unique_flags = find_similar_to_previous(embeddings[list(first_positions)], threshold)
+        for position, flag in zip(first_positions.values(), unique_flags):
+            flags[position] = flag
 
-    if 0 < threshold < 1:
-        model = SentenceTransformer(model_name)
-        embeddings = model.encode(list(preprocess_func(data)))
-        similarities = model.similarity(embeddings, embeddings)
+        result.append(zip(group, flags))
+        start = stop
 
-        # For every sentence...
-        for i in range(length):
-            # ... check similarity with every next sentence.
-            # No need to check similarity with previous ones
-            # as it was checked in previous iterations.
-            for ii in range(i + 1, length):
-                sim = similarities[i, ii]
-                # If similarity is >= than a threshold,
-                # then mark other sentence as a duplicate.
-                # DO NOTHING if similarity is less!
-                if sim >= threshold:
-                    flags[ii] = True
+    return result
+
+
+SIMILARITY_BLOCK_SIZE = 1024
+
+
+def find_similar_to_previous(embeddings: ndarray, threshold: float, /) -> list[bool]:
+    """
+    For every embedding of the given normalized embeddings
+    returns whether it is similar to any previous one.
+
+    Similarities are computed in blocks of rows,
+    hence the whole similarity matrix is never kept in memory.
+    """
+    flags = []
+    for start in range(0, len(embeddings), SIMILARITY_BLOCK_SIZE):
+        block = embeddings[start:start + SIMILARITY_BLOCK_SIZE]
+        similarities = block @ embeddings[:start + len(block)].T
+        # A sentence is marked as a duplicate if it is similar to any previous one,
+        # i.e., if its row has a similarity >= than a threshold below the main diagonal.
+        # Similarities above the diagonal and on it are ignored.
+        similar = tril(similarities >= threshold, k=start - 1)
+        flags.extend(similar.any(axis=1).tolist())
 
-    return zip(data, flags)
+    return flags
 
 
-__all__ = 'analyze_sentences',
+__all__ = 'load_model', 'analyze_sentences', 'analyze_sentence_groups', 'find_similar_to_previous'
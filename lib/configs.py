@@ -1,8 +1,18 @@
 import tomllib
 from logging.config import dictConfig
-from typing import Any
+from typing import Annotated, Any, Literal
 
-from pydantic import BaseModel, Field, PositiveInt
+from pydantic import AfterValidator, BaseModel, Field, PositiveFloat, PositiveInt
+
+
+def _check_non_zero(value: int, /) -> int:
+    if value == 0:
+        raise ValueError('value must not be zero')
+
+    return value
+
+
+type NonZeroInt = Annotated[int, AfterValidator(_check_non_zero)]
 
 
 class BaseConfig(BaseModel, strict=True, extra='forbid', frozen=True):
@@ -24,6 +34,7 @@ class ScannerConfig(BaseConfig):
     subcategories: frozenset[str] = Field(strict=False)
     topics: frozenset[str] = Field(strict=False)
     times_per_topic: PositiveInt
+    concurrency: PositiveInt
 
 
 class AnalyzerConfig(BaseConfig):
@@ -42,6 +53,15 @@ class AnalyzerConfig(BaseConfig):
     include_duplicates: bool
 
     sentence_transformer_model: str
+    device: str
+    batch_size: PositiveInt
+    backend: Literal['torch', 'onnx', 'openvino']
+    torch_dtype: Literal['float32', 'float16', 'bfloat16']
+    quantization: Literal['', 'arm64', 'avx2', 'avx512', 'avx512_vnni']
+    onnx_model_dirpath: str
+    embedding_cache_filepath: str
+    n_jobs: NonZeroInt
+    use_re2: bool
     punctuation: str
     text_to_remove: list[str]
     text_to_replace: dict[str, str]
@@ -54,6 +74,8 @@ class DeepSeekConfig(BaseConfig):
     """
     api_key: str
     system_prompt_filepath: str
+    timeout: PositiveFloat
+    stream: bool
     api_params: dict[str, Any]
 
 
@@ -65,6 +87,7 @@ class QuerierConfig(BaseConfig):
     predefined_filepath: str
     output_filepath: str
     log_frequency: PositiveInt
+    concurrency: PositiveInt
     deepseek: DeepSeekConfig
 
 
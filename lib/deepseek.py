@@ -1,31 +1,35 @@
 import json
 import re
-from http.client import HTTPResponse
+from http.client import HTTPResponse, HTTPSConnection
+from io import BytesIO
 from json import JSONDecodeError
 from logging import getLogger
+from socket import SHUT_RDWR
+from threading import local
 from typing import Any, Self
 from urllib.error import HTTPError
-from urllib.request import Request, urlopen
+
+import orjson
 
 from .configs import DeepSeekConfig
 
 logger = getLogger('deepseek')
 
-PATTERN_BARS_AND_SPACES = re.compile(r'\s*\n(\|\n+)+\s*|\s+')
+PATTERN_BARS = re.compile(r'(\s*\n(?:\|\n+)+\s*)')
+PATTERN_SPACES = re.compile(r'\s+')
 PATTERN_TRAILING_SPACES = re.compile(r'[^\S\n]+\n')
 
 
-def _replace_bars_and_spaces(m: re.Match, /) -> str:
-    if m[0].isspace(): return ' '
-
-    return '\n' * m[0].count('|')
-
-
 def format_system_prompt(prompt: str, /) -> str:
     """
     Properly formats a system prompt for LLMs.
     """
-    return PATTERN_BARS_AND_SPACES.sub(_replace_bars_and_spaces, prompt.strip())
+    # Odd parts are lines with bars, every bar is replaced with a line break.
+    # Even parts are text between them, every space sequence there is replaced with a space.
+    parts = PATTERN_BARS.split(prompt.strip())
+    parts[::2] = [PATTERN_SPACES.sub(' ', part) for part in parts[::2]]
+    parts[1::2] = ['\n' * part.count('|') for part in parts[1::2]]
+    return ''.join(parts)
 
 
 def format_user_message(message: str, /) -> str:
@@ -45,15 +49,51 @@ def format_response(response: str, /) -> str:
 class DeepSeekClient:
     """
     A client for querying DeepSeek LLM.
-    """
-    __slots__ = '_api_key', '_system_prompt', '_api_params'
-
-    url = 'https://api.deepseek.com/chat/completions'
 
-    def __init__(self, /, api_key: str, system_prompt: str, **api_params: Any) -> None:
-        self._api_key = api_key
+    The client keeps HTTPS connections alive between API calls,
+    call :meth:`close` or use the client as a context manager to release them.
+    The client can be used from several threads, each thread has its own connection.
+    """
+    __slots__ = (
+        '_system_prompt',
+        '_api_params',
+        '_body_prefixes',
+        '_headers',
+        '_timeout',
+        '_stream',
+        '_local',
+        '_connections',
+        )
+
+    host = 'api.deepseek.com'
+    path = '/chat/completions'
+    url = f'https://{host}{path}'
+
+    def __init__(
+            self,
+            /,
+            api_key: str,
+            system_prompt: str,
+            timeout: float | None = None,
+            stream: bool = False,
+            **api_params: Any,
+            ) -> None:
         self._system_prompt = format_system_prompt(system_prompt)
         self._api_params = api_params
+        # Everything except the user message is the same for all calls, hence serialized once
+        self._body_prefixes = {
+            is_stream: self._prepare_body_prefix(is_stream)
+            for is_stream in (False, True)
+            }
+        self._headers = {
+            'Content-Type':  'application/json',
+            'Accept':        'application/json',
+            'Authorization': f'Bearer {api_key}'
+            }
+        self._timeout = timeout
+        self._stream = stream
+        self._local = local()
+        self._connections: list[HTTPSConnection] = []
 
     @classmethod
     def from_config(cls, config: DeepSeekConfig, /) -> Self:
@@ -66,9 +106,38 @@ class DeepSeekClient:
         return cls(
             api_key=config.api_key,
             system_prompt=system_prompt,
+            timeout=config.timeout,
+            stream=config.stream,
             **config.api_params,
             )
 
+    def close(self, /) -> None:
+        """
+        Closes all connections to the API.
+        Requests in progress in other threads fail immediately and are not retried.
+        The client can still be used afterward, connections are re-established if needed.
+        """
+        connections = self._connections
+        # Connections of all threads are forgotten, new ones are opened on next requests
+        self._local = local()
+        self._connections = []
+        for connection in connections:
+            sock = connection.sock
+            if sock is not None:
+                # Closing alone does not wake threads blocked on reading a response
+                try:
+                    sock.shutdown(SHUT_RDWR)
+                except OSError:
+                    pass
+
+            connection.close()
+
+    def __enter__(self, /) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb, /) -> None:
+        self.close()
+
     def get_response_for_user_message(self, message: str, /) -> str:
         """
         Calls API with the given message and returns the response.
@@ -76,59 +145,129 @@ class DeepSeekClient:
         If the message is the empty string or consists purely from space-like symbols,
         immediately returns the empty string performing no API calls.
 
-        If the API call fails, logs the error occurred
+        If the API call fails or is not answered in time, logs the error occurred
         and returns the empty string without generating a report.
         """
-        if not message or message.isspace():
+        message = format_user_message(message)
+        if not message:
             return ''
 
-        message = format_user_message(message)
+        api_call = self._streaming_api_call if self._stream else self._blocking_api_call
         try:
-            response = self._blocking_api_call(message)
+            response = api_call(message)
         except HTTPError as exc:
             self._handle_api_call_error(exc)
             return ''
+        except TimeoutError:
+            # The response may still arrive, hence the connection cannot be reused
+            self._get_connection().close()
+            logger.error(f'DeepSeek did not respond within {self._timeout} seconds')
+            return ''
 
         return format_response(response)
 
     def _blocking_api_call(self, message: str, /) -> str:
-        req = self._prepare_request(message, False)
+        body = self._prepare_body(message, False)
+        with self._post(body) as response:
+            # The response must be read completely to reuse the connection
+            content = response.read()
+            if response.status >= 400:
+                raise self._make_http_error(response, content)
+
+        data = orjson.loads(content)
+        return data['choices'][0]['message']['content']
 
-        response: HTTPResponse
-        with urlopen(req) as response:
-            data = json.loads(response.read())
+    def _streaming_api_call(self, message: str, /) -> str:
+        body = self._prepare_body(message, True)
+        parts = []
+        with self._post(body) as response:
+            if response.status >= 400:
+                raise self._make_http_error(response, response.read())
 
-        return data['choices'][0]['message']['content']
+            # Server-sent events, every piece of the response is in a separate data line.
+            # Other lines are either empty or keep-alive comments.
+            for line in response:
+                if not line.startswith(b'data:'): continue
+
+                data = line[5:].strip()
+                if data == b'[DONE]': break
 
-    def _prepare_request(self, message: str, is_stream: bool, /) -> Request:
+                content = orjson.loads(data)['choices'][0]['delta'].get('content')
+                if content: parts.append(content)
+
+            # The response must be read completely to reuse the connection
+            response.read()
+
+        return ''.join(parts)
+
+    def _make_http_error(self, response: HTTPResponse, content: bytes, /) -> HTTPError:
+        return HTTPError(
+            self.url,
+            response.status,
+            response.reason,
+            response.headers,
+            BytesIO(content),
+            )
+
+    def _get_connection(self, /) -> HTTPSConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # The connection is established on the first request
+            connection = HTTPSConnection(self.host, timeout=self._timeout)
+            self._local.connection = connection
+            self._connections.append(connection)
+
+        return connection
+
+    def _post(self, body: bytes, /) -> HTTPResponse:
+        connection = self._get_connection()
+        # The server may drop an idle keep-alive connection, hence a reused one may be stale
+        is_reused = connection.sock is not None
+        try:
+            connection.request('POST', self.path, body, self._headers)
+            return connection.getresponse()
+        except (BrokenPipeError, ConnectionResetError):
+            # These errors, including RemoteDisconnected, occur before any response.
+            # Other errors like timeouts are not retried,
+            # because the server may have already processed the request.
+            connection.close()
+            # A connection closed by close() is not retried
+            if not is_reused or connection not in self._connections:
+                raise
+
+        # Reconnect once
+        connection.request('POST', self.path, body, self._headers)
+        return connection.getresponse()
+
+    def _prepare_body_prefix(self, is_stream: bool, /) -> bytes:
         data = self._api_params.copy()
         data['model'] = self._api_params.get('model')
         data['stream'] = is_stream
-        data['messages'] = [
-            {'role': 'system', 'content': self._system_prompt},
-            {'role': 'user', 'content': message},
-            ]
+        # Messages must go last, so the user message can be appended to the serialized data
+        data.pop('messages', None)
+        data['messages'] = [{'role': 'system', 'content': self._system_prompt}]
 
-        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
-        headers = {
-            'Content-Type':  'application/json',
-            'Accept':        'application/json',
-            'Authorization': f'Bearer {self._api_key}'
-            }
+        # orjson always produces compact UTF-8, strip closing ]}
+        return orjson.dumps(data)[:-2]
 
-        return Request(self.url, body, headers, method='POST')
+    def _prepare_body(self, message: str, is_stream: bool, /) -> bytes:
+        user_message = orjson.dumps({'role': 'user', 'content': message})
+        return b''.join((self._body_prefixes[is_stream], b',', user_message, b']}'))
 
     @staticmethod
     def _handle_api_call_error(exc: HTTPError, /) -> None:
         exc_msg = exc.read()
         try:
-            data = json.loads(exc_msg)
-        except JSONDecodeError:
-            error_str = ' ' + exc_msg.decode()
+            error = json.loads(exc_msg)['error']
+        except (JSONDecodeError, LookupError, TypeError):
+            error_str = exc_msg.decode()
         else:
-            error_str = '\n' + json.dumps(data['error'], ensure_ascii=False, indent=2)
+            # Usually, the message is enough to understand the error
+            error_str = isinstance(error, dict) and error.get('message')
+            if not error_str:
+                error_str = json.dumps(error, ensure_ascii=False)
 
-        logger.error(f'An error occurred when requesting DeepSeek:{error_str}')
+        logger.error(f'An error occurred when requesting DeepSeek ({exc.code}): {error_str}')
 
 
 __all__ = 'DeepSeekClient',
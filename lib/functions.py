@@ -1,11 +1,41 @@
-import json
 import re
-from collections import Counter
-from collections.abc import Iterator, Set
-
+import sys
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Iterator, Set
+from concurrent.futures import Executor, Future
+from functools import cache, lru_cache
+from itertools import chain, starmap
+
+import ijson
 import unicodedata
 
-from .globals import QuestionLists, QuestionsJSON
+from .globals import QuestionLists
+
+
+def compile_pattern(
+        pattern: str,
+        /,
+        ignorecase: bool = False,
+        use_re2: bool = False,
+        ) -> re.Pattern:
+    """
+    Compiles the given regular expression with RE2 engine if ``use_re2`` is true
+    and with the standard engine otherwise.
+    RE2 engine requires package ``google-re2`` to be installed.
+    Returned object supports the same methods as :class:`re.Pattern`.
+
+    RE2 runs in linear time, but does not support backreferences and lookaround assertions,
+    and its ``\\s`` and ``\\w`` match only ASCII characters.
+    """
+    if ignorecase:
+        pattern = '(?i)' + pattern
+
+    if use_re2:
+        import re2
+
+        return re2.compile(pattern)
+
+    return re.compile(pattern)
 
 
 def iterate_questions(
@@ -21,49 +51,101 @@ def iterate_questions(
     Possible filtering can be added by specifying categories, subcategories and topics.
     If a filter set is empty, then no filtering is made for that set.
     """
-    with open(filepath) as f:
-        questions: QuestionsJSON = json.load(f)
+    for category, category_dict in _select_items(_iterate_categories(filepath), categories):
+        for subcategory, topic_dict in _select_items(category_dict.items(), subcategories):
+            for topic, q_lists in _select_items(topic_dict.items(), topics):
+                yield category, subcategory, topic, q_lists
 
-    for category, category_dict in questions.items():
-        if categories and category not in categories: continue
 
-        for subcategory, topic_dict in category_dict.items():
-            if subcategories and subcategory not in subcategories: continue
+def _select_items[K, V](items: Iterable[tuple[K, V]], keys: Set, /) -> Iterable[tuple[K, V]]:
+    # Items are not checked at all if there is no filter
+    if not keys: return items
 
-            for topic, q_lists in topic_dict.items():
-                if topics and topic not in topics: continue
+    return ((key, value) for key, value in items if key in keys)
+
+
+JSON_CHUNK_SIZE = 1 << 16
 
-                yield category, subcategory, topic, q_lists
 
+def _iterate_categories(
+        filepath: str,
+        /,
+        ) -> Iterator[tuple[str, dict[str, dict[str, QuestionLists]]]]:
+    # The file is parsed incrementally, only one category is kept in memory at a time.
+    # The file is written in the default encoding, but ijson accepts only UTF-8,
+    # hence the file is read as text and fed to the parser in chunks.
+    parsed = ijson.sendable_list()
+    parser = ijson.kvitems_coro(parsed, '')
+    with open(filepath) as f:
+        while chunk := f.read(JSON_CHUNK_SIZE):
+            parser.send(chunk.encode('utf-8'))
+            yield from parsed
+            parsed.clear()
+
+    parser.close()
+    yield from parsed
 
-PATTERN_SYMBOLS = re.compile(r'[^\s\w]')
+
+# The standard engine is used deliberately: engines like RE2 are slower on short strings,
+# because the overhead of each call outweighs faster matching
+PATTERN_WORDS = re.compile(r'\w+')
 
 
 def count_words(questions: Iterator[str], output_filepath: str, /) -> None:
     """
     Counts words in the given questions and saves the result in the given output file.
     """
-    counter = Counter()
-    for question in questions:
-        question = question.lower()
-        question = PATTERN_SYMBOLS.sub(' ', question)
-        counter.update(question.split())
+    # The whole pipeline runs in C; only words are lowered, not the whole questions
+    words = chain.from_iterable(map(PATTERN_WORDS.findall, questions))
+    counter = Counter(map(str.lower, words))
 
     max_count_length = len(str(max(counter.values())))
     max_word_length = max(map(len, counter))
+    line_format = f'{{:{max_word_length}}}: {{:{max_count_length}}}\n'.format
     with open(output_filepath, 'w') as f:
-        for word, count in counter.most_common():
-            f.write(f'{word:{max_word_length}}: {count:{max_count_length}}\n')
+        f.write(''.join(starmap(line_format, counter.most_common())))
+
+
+@cache
+def _get_nonspacing_marks_table() -> dict[int, None]:
+    # Built on the first use, because it requires checking every Unicode code point
+    return dict.fromkeys(
+        c for c in range(sys.maxunicode + 1)
+        if unicodedata.category(chr(c)) == 'Mn'
+        )
 
 
+@lru_cache(maxsize=1 << 16)
 def strip_accents(text: str, /) -> str:
     """
     Removes accents in the given text.
+    Results for recently processed texts are cached, repeated texts are processed once.
     """
-    return ''.join(
-        c for c in unicodedata.normalize('NFD', text)
-        if unicodedata.category(c) != 'Mn'
-        )
+    return unicodedata.normalize('NFD', text).translate(_get_nonspacing_marks_table())
+
+
+def prefetch[T, R](
+        func: Callable[[T], R],
+        iterable: Iterable[T],
+        executor: Executor,
+        depth: int,
+        /,
+        ) -> Iterator[tuple[T, R]]:
+    """
+    Iterates over pairs of items from the given iterable and results of the given function
+    applied to them. Results are evaluated in the given executor
+    and up to ``depth`` results are evaluated ahead of the consumer.
+    """
+    pending: deque[tuple[T, Future[R]]] = deque()
+    for item in iterable:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) > depth:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
 
 
-__all__ = 'iterate_questions', 'count_words', 'strip_accents'
+__all__ = 'compile_pattern', 'iterate_questions', 'count_words', 'strip_accents', 'prefetch'
@@ -1,4 +1,4 @@
-from collections.abc import Callable, Iterator, Sequence
+from collections.abc import Callable, Iterable, Iterator
 from typing import TypedDict
 
 
@@ -16,6 +16,6 @@ class QuestionLists(TypedDict):
 
 type Questions = dict[str, dict[str, dict[str, QuestionSets]]]
 type QuestionsJSON = dict[str, dict[str, dict[str, QuestionLists]]]
-type PreprocessFunc = Callable[[Sequence[str]], Iterator[str]]
+type PreprocessFunc = Callable[[Iterable[str]], Iterator[str]]
 
 __all__ = 'QuestionSets', 'QuestionLists', 'Questions', 'QuestionsJSON', 'PreprocessFunc'
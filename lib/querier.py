@@ -1,12 +1,17 @@
 import csv
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from typing import Any
 
 from lib.configs import QuerierConfig
 from lib.deepseek import DeepSeekClient
+from lib.functions import prefetch
 
 logger = getLogger('querier')
 
+CSV_BUFFER_SIZE = 1 << 20
+CSV_ROWS_PER_WRITE = 1024
+
 
 def get_predefined_answers(filepath: str, /) -> dict[tuple[Any, ...], str]:
     """
@@ -36,9 +41,23 @@ def query(config: QuerierConfig, /) -> None:
     predefined = get_predefined_answers(config.predefined_filepath)
     logger.info(f'Loaded {len(predefined)} predefined answers')
 
+    def get_answer(item: tuple[list[str], str | None, bool], /) -> str:
+        row, answer, is_original = item
+        if answer:
+            return answer
+
+        if is_original:
+            question = row[-2]
+            return client.get_response_for_user_message(question)
+
+        return ''
+
     log_frequency = config.log_frequency
+    # Requests to DeepSeek are mostly waiting for the response, hence threads
+    executor = ThreadPoolExecutor(config.concurrency, thread_name_prefix='querier')
     inp = None
     out = None
+    pending_rows = []
     line_no = 0
     count_predefined = 0
     count_queried = 0
@@ -47,33 +66,33 @@ def query(config: QuerierConfig, /) -> None:
     try:
         inp = open(config.input_filepath, newline='')
         reader = csv.reader(inp, dialect='excel')
-        out = open(config.output_filepath, 'w', newline='')
+        out = open(config.output_filepath, 'w', newline='', buffering=CSV_BUFFER_SIZE)
         writer = csv.writer(out, dialect='excel')
 
         logger.info('The querier is started')
-        for line_no, row in enumerate(reader, 1):
-            col_tuple = tuple(row[:-1])
-            answer = predefined.get(col_tuple)
-            if answer:
+        items = (
+            (row, predefined.get(tuple(row[:-1])), row[-1].lower() == 'false')
+            for row in reader
+            )
+        # Keep all workers busy while answers are written in the order of questions
+        it = prefetch(get_answer, items, executor, config.concurrency * 2)
+        for line_no, ((row, predefined_answer, is_original), answer) in enumerate(it, 1):
+            if predefined_answer:
                 count_predefined += 1
+            elif not is_original:
+                count_ignored += 1
+            elif answer:
+                count_queried += 1
             else:
-                flag = row[-1].lower()
-                is_original = flag == 'false'
-                question = row[-2]
-                if is_original:
-                    answer = client.get_response_for_user_message(question)
-                    if answer:
-                        count_queried += 1
-                    else:
-                        logger.warning(f'Empty answer for question at line {line_no}')
-                        count_queried_err += 1
-
-                else:
-                    answer = ''
-                    count_ignored += 1
+                logger.warning(f'Empty answer for question at line {line_no}')
+                count_queried_err += 1
 
             row.append(answer)
-            writer.writerow(row)
+            pending_rows.append(row)
+            if len(pending_rows) == CSV_ROWS_PER_WRITE:
+                writer.writerows(pending_rows)
+                pending_rows.clear()
+
             if line_no % log_frequency == 0:
                 logger.info(
                     f'Answer counts: '
@@ -82,12 +101,18 @@ def query(config: QuerierConfig, /) -> None:
                     )
 
     finally:
-        if inp: inp.close()
-
         if out:
             logger.info(f'Saving result to {config.output_filepath!r}')
+            # Rows are written even if an error occurred, answers are not lost.
+            # They are written before stopping workers, so nothing can interrupt it.
+            writer.writerows(pending_rows)
             out.close()
 
+        if inp: inp.close()
+        # Closing connections interrupts requests in progress, hence workers stop quickly
+        executor.shutdown(wait=False, cancel_futures=True)
+        client.close()
+
         logger.info('The querier is stopped')
 
         logger.info(
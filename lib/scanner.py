@@ -1,10 +1,13 @@
-import json
-from collections import defaultdict
+import re
+from collections.abc import Iterator
+from contextlib import contextmanager
 from logging import Logger, getLogger
+from queue import Empty, SimpleQueue
 from threading import Event, Thread
 from typing import Any
 
-from playwright.sync_api import BrowserContext, Error, Page, expect, sync_playwright
+import orjson
+from playwright.sync_api import BrowserContext, Error, Locator, Page, expect, sync_playwright
 
 from .configs import ScannerConfig
 from .globals import QuestionSets, Questions
@@ -13,6 +16,9 @@ logger = getLogger('scanner')
 
 type TopicHierarchy = dict[str, dict[str, list[str]]]
 
+PATTERN_SPACES = re.compile(r'\s+')
+QUESTION_SET_KEYS = tuple(QuestionSets.__annotations__)
+
 
 def open_laba_ai(context: BrowserContext, config: ScannerConfig, /) -> Page:
     """
@@ -32,16 +38,19 @@ def get_topics(page: Page, /) -> TopicHierarchy:
     """
     Extracts topic hierarchy from the page.
     """
-    topics = defaultdict(lambda: defaultdict(list))
+    topics = {}
     locator = page.get_by_role('checkbox')
     expect(locator.first).to_be_visible(timeout=60_000)
 
-    for i in range(locator.count()):
-        box = locator.nth(i)
-        value = box.get_attribute('value')
+    # All values are fetched in a single call to the browser.
+    # Attributes are used, because property value of a checkbox defaults to 'on'.
+    values: list[str | None] = locator.evaluate_all(
+        'boxes => boxes.map(box => box.getAttribute("value"))'
+        )
+    for value in values:
         if value:
             major, minor, topic = value.split('___', maxsplit=2)
-            topics[major][minor].append(topic)
+            topics.setdefault(major, {}).setdefault(minor, []).append(topic)
 
     return topics
 
@@ -52,7 +61,7 @@ def read_existing_questions(filepath: str, topics: TopicHierarchy, /) -> Questio
     and converts question lists into sets.
     """
     with open(filepath) as f:
-        questions: dict = json.load(f)
+        questions: dict = orjson.loads(f.read())
 
     for category, category_dict in topics.items():
         cat_dict = questions.setdefault(category, {})
@@ -62,12 +71,9 @@ def read_existing_questions(filepath: str, topics: TopicHierarchy, /) -> Questio
 
             for topic in topic_names:
                 topic_dict = subcat_dict.setdefault(topic, {})
-                for key in QuestionSets.__annotations__:
-                    li = topic_dict.get(key)
-                    if li is None:
-                        topic_dict[key] = set()
-                    else:
-                        topic_dict[key] = set(li)
+                for key in QUESTION_SET_KEYS:
+                    # Missing and null lists become empty sets
+                    topic_dict[key] = set(topic_dict.get(key) or ())
 
     return questions
 
@@ -83,25 +89,32 @@ def save_questions(questions: Questions, filepath: str, /) -> None:
     """
     Saves a dictionary with questions to a designated file in JSON format.
     """
+    data = orjson.dumps(
+        questions,
+        default=_convert_set,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE,
+        )
+    # orjson produces UTF-8, but the file is written in the default encoding
     with open(filepath, 'w') as f:
-        json.dump(questions, f, ensure_ascii=False, indent=2, default=_convert_set)
-        f.write('\n')
+        f.write(data.decode('utf-8'))
+
 
+def locate_question_text(page: Page, /) -> Locator:
+    """
+    Locates the element with text of a question in Laba.AI.
+    """
+    return page.locator('[class*="text-sm text-balance select-none pointer-events-none"]')
 
-def get_question_text(page: Page, /) -> str:
+
+def get_question_text(locator: Locator, /) -> str:
     """
-    Gets text of a question in Laba.AI.
+    Gets text of a question in Laba.AI from the given locator of the question element.
     """
-    text = (
-        page
-        .locator('[class*="text-sm text-balance select-none pointer-events-none"]')
-        .inner_text()
-    )
+    text = locator.inner_text()
     # Some questions are identically the same, but use 'е' instead of 'ё'.
     # Better to replace 'ё' completely to avoid trivial duplicates.
     text = text.replace('ё', 'е').strip('.')
-    text = ' '.join(text.split())
-    return text
+    return PATTERN_SPACES.sub(' ', text).strip()
 
 
 def record_questions(
@@ -150,11 +163,13 @@ def record_questions(
             return False
 
         # Questions
-        q1 = get_question_text(page)
-        page.get_by_text('Next question', exact=True).click()
-        q2 = get_question_text(page)
-        page.get_by_text('Next question', exact=True).click()
-        q3 = get_question_text(page)
+        question_text = locate_question_text(page)
+        next_question = page.get_by_text('Next question', exact=True)
+        q1 = get_question_text(question_text)
+        next_question.click()
+        q2 = get_question_text(question_text)
+        next_question.click()
+        q3 = get_question_text(question_text)
 
         q_sets['q1'].add(q1)
         q_sets['q2'].add(q2)
@@ -162,6 +177,67 @@ def record_questions(
         return True
 
 
+@contextmanager
+def launch_browser() -> Iterator[BrowserContext]:
+    """
+    Launches a new browser and yields its context with one empty page.
+    Playwright objects can be used only in the thread they are created in.
+    """
+    with (
+        sync_playwright() as p,
+        # Cannot get questions in headless mode
+        p.chromium.launch(handle_sigint=False, headless=False) as browser,
+        browser.new_context(permissions=['microphone', 'camera']) as context,
+        # Open an empty page to keep browser open
+        context.new_page(),
+        ):
+        yield context
+
+
+def record_topics(
+        context: BrowserContext,
+        config: ScannerConfig,
+        tasks: SimpleQueue[tuple[str, QuestionSets]],
+        stop_event: Event,
+        /,
+        ) -> None:
+    """
+    Takes topics from the given queue and records their questions
+    until the queue is empty or the given event is set.
+    """
+    times_per_topic = config.times_per_topic
+    while True:
+        try:
+            topic, q_sets = tasks.get_nowait()
+        except Empty:
+            return
+
+        success_times = 0
+        while success_times < times_per_topic:
+            # Exit immediately if the event is set
+            if stop_event.is_set(): return
+
+            try:
+                success = record_questions(context, config, topic, q_sets)
+            except Error as e:
+                logger.error(str(e))
+            else:
+                success_times += success
+
+
+def _worker_target(
+        config: ScannerConfig,
+        tasks: SimpleQueue[tuple[str, QuestionSets]],
+        stop_event: Event,
+        /,
+        ) -> None:
+    try:
+        with launch_browser() as context:
+            record_topics(context, config, tasks, stop_event)
+    except Exception:
+        logger.exception('An unknown error has occurred in a scanner worker')
+
+
 def scan(config: ScannerConfig, stop_event: Event, /) -> None:
     """
     Starts scanning Laba.AI. Gracefully stops if at some point the given event is set.
@@ -172,16 +248,8 @@ def scan(config: ScannerConfig, stop_event: Event, /) -> None:
     categories = config.categories
     subcategories = config.subcategories
     topics = config.topics
-    times_per_topic = config.times_per_topic
 
-    with (
-        sync_playwright() as p,
-        # Cannot get questions in headless mode
-        p.chromium.launch(handle_sigint=False, headless=False) as browser,
-        browser.new_context(permissions=['microphone', 'camera']) as context,
-        # Open an empty page to keep browser open
-        context.new_page(),
-        ):
+    with launch_browser() as context:
         logger.info('Getting existing topic hierarchy on the site')
         with open_laba_ai(context, config) as page:
             topic_hierarchy = get_topics(page)
@@ -193,32 +261,45 @@ def scan(config: ScannerConfig, stop_event: Event, /) -> None:
         logger.info(f'Loading questions stored locally in {questions_filepath!r}')
         questions = read_existing_questions(questions_filepath, topic_hierarchy)
 
-        logger.info('The scanner is started. You can minimize the browser')
-        try:
-            # Iterate over existing topic hierarchy
-            for category, category_dict in topic_hierarchy.items():
-                if categories and category not in categories: continue
+        # Iterate over existing topic hierarchy
+        tasks = SimpleQueue()
+        for category, category_dict in topic_hierarchy.items():
+            if categories and category not in categories: continue
 
-                for subcategory, topic_list in category_dict.items():
-                    if subcategories and subcategory not in subcategories: continue
+            for subcategory, topic_list in category_dict.items():
+                if subcategories and subcategory not in subcategories: continue
 
-                    for topic in topic_list:
-                        if topics and topic not in topics: continue
+                for topic in topic_list:
+                    if topics and topic not in topics: continue
 
-                        q_sets = questions[category][subcategory][topic]
-                        success_times = 0
-                        while success_times < times_per_topic:
-                            # Exit immediately if the event is set
-                            if stop_event.is_set(): return
+                    tasks.put((topic, questions[category][subcategory][topic]))
 
-                            try:
-                                success = record_questions(context, config, topic, q_sets)
-                            except Error as e:
-                                logger.error(str(e))
-                            else:
-                                success_times += success
+        # Every topic is taken by a single worker, hence its sets are never shared.
+        # This thread is a worker too, others run their own browsers.
+        workers = [
+            Thread(
+                target=_worker_target,
+                args=(config, tasks, stop_event),
+                name=f'scanner-{i}',
+                daemon=True,
+                )
+            for i in range(1, config.concurrency)
+            ]
 
+        logger.info('The scanner is started. You can minimize the browser')
+        try:
+            for worker in workers:
+                worker.start()
+
+            record_topics(context, config, tasks, stop_event)
+        except BaseException:
+            # Stop other workers as well
+            stop_event.set()
+            raise
         finally:
+            for worker in workers:
+                if worker.is_alive(): worker.join()
+
             logger.info(f'Saving recorded questions to {questions_filepath!r}')
             save_questions(questions, questions_filepath)
             logger.info('The scanner is stopped')
@@ -228,12 +309,13 @@ class Scanner:
     """
     A class for scanning Laba.AI website for questions.
     """
-    __slots__ = 'config', '_thread', '_stop_event', '_is_running'
+    __slots__ = 'config', '_thread', '_stop_event', '_stopped_event', '_is_running'
 
     def __init__(self, config: ScannerConfig, /) -> None:
         self.config = config
         self._thread: Thread | None = None
         self._stop_event: Event | None = None
+        self._stopped_event = Event()
         self._is_running = False
 
     @property
@@ -259,6 +341,7 @@ class Scanner:
         self._is_running = True
         self._thread = Thread(target=self._thread_target, name='scanner', daemon=True)
         self._stop_event = Event()
+        self._stopped_event = Event()
         self._thread.start()
 
     def stop(self, /) -> None:
@@ -272,12 +355,21 @@ class Scanner:
 
             self._thread.join()
 
-    def _thread_target(self, /) -> None:
-        scan(self.config, self._stop_event)
+    def wait(self, /, timeout: float | None = None) -> bool:
+        """
+        Waits until this scanner stops or the given timeout in seconds expires.
+        Returns ``True`` if this scanner is not running and ``False`` otherwise.
+        """
+        return self._stopped_event.wait(timeout) if self._is_running else True
 
-        self._thread = None
-        self._stop_event = None
-        self._is_running = False
+    def _thread_target(self, /) -> None:
+        try:
+            scan(self.config, self._stop_event)
+        finally:
+            self._thread = None
+            self._stop_event = None
+            self._is_running = False
+            self._stopped_event.set()
 
 
 __all__ = 'Scanner',
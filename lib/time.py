@@ -15,16 +15,7 @@ DURATION_UNITS = {
     }
 
 
-def _generate_non_zero_units[T](values: list[T], /) -> Iterator[tuple[T, str]]:
-    it = zip(values, DURATION_UNIT_NAMES)
-    for value_unit in it:
-        if value_unit[0] != 0:
-            yield value_unit
-            yield from it
-            break
-    else:
-        # The iterator is exhausted, yield the very last value with its unit
-        yield values[-1], DURATION_UNIT_NAMES[-1]
+_DURATION_TABLE = tuple(zip(DURATION_UNITS.values(), DURATION_UNIT_NAMES))
 
 
 def format_seconds(seconds: float, /) -> str:
@@ -32,15 +23,15 @@ def format_seconds(seconds: float, /) -> str:
     Formats the given number of seconds into
     years, months, weeks, days, hours, minutes and seconds.
     """
-    data = []
-    for mul in DURATION_UNITS.values():
-        value, seconds = divmod(seconds, mul)
-        data.append(int(value))
-
-    return ' '.join(
-        f'{value}{unit}'
-        for value, unit in _generate_non_zero_units(data)
-        )
+    parts = []
+    remainder = int(seconds)
+    for mul, unit in _DURATION_TABLE:
+        value, remainder = divmod(remainder, mul)
+        # Leading zero units are skipped
+        if value or parts:
+            parts.append(f'{value}{unit}')
+
+    return ' '.join(parts) if parts else f'0{DURATION_UNIT_NAMES[-1]}'
 
 
 @contextmanager
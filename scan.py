@@ -23,7 +23,6 @@ def main() -> None:
     args = parser.parse_args()
 
     from logging import getLogger
-    from time import sleep
 
     from lib.configs import read_config
     from lib.scanner import Scanner
@@ -37,8 +36,9 @@ def main() -> None:
         try:
             logger.info('Press Ctrl+C to stop this script')
             scanner.start()
-            while scanner.is_running:
-                sleep(60)
+            # Waiting without a timeout cannot be interrupted by Ctrl+C on some platforms
+            while not scanner.wait(1):
+                pass
 
         except KeyboardInterrupt:
             logger.info('Ctrl+C received, stopping the script...')